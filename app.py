@@ -2,8 +2,13 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import date, datetime
-from db import init_db, fetch_df, execute, get_params, month_yyyymm
+from db import (init_db, fetch_df, fetch_typed_df, fetch_many, execute, insert_row, update_row,
+                get_params, month_yyyymm, revalidate_odometers, OdometerError, DROPBOX_ENABLED, upload_status)
+from backup import start_backup_scheduler, request_snapshot, request_restore, list_snapshots, backup_status
+from ledger import init_ledger, refresh_ledger, vehicle_summary, vehicle_ledger
 init_db()
+init_ledger()
+start_backup_scheduler()
 
 
 # ---------- Utils ----------
@@ -48,20 +53,18 @@ def filter_table(df, key_prefix="flt", num_cols=4):
     cols = st.columns(num_cols)
 
     selections = {}
+    lookups = {}
     for i, c in enumerate(df.columns):
         col = cols[i % num_cols]
-        options = (
-            df[c]
-            .astype(str)
-            .replace({"nan": ""})
-            .dropna()
-            .unique()
-            .tolist()
-        )
+        # Rótulos só dos valores distintos (sem converter a coluna inteira p/ str),
+        # ordenados pelo valor (datas em ordem cronológica, não pelo texto dd/mm)
+        uniques = df[c].dropna().unique()
         try:
-            options = sorted(options)
-        except Exception:
-            pass
+            uniques = sorted(uniques)
+        except TypeError:
+            uniques = sorted(uniques, key=str)
+        lookups[c] = {(date_br(v) if hasattr(v, "strftime") else str(v)): v for v in uniques}
+        options = list(lookups[c].keys())
 
         selections[c] = col.multiselect(
             c,
@@ -76,7 +79,8 @@ def filter_table(df, key_prefix="flt", num_cols=4):
     # Aplica os filtros
     for c, selected in selections.items():
         if selected:
-            df = df[df[c].astype(str).isin(selected)]
+            values = [lookups[c][v] for v in selected if v in lookups[c]]
+            df = df[df[c].isin(values)]
 
     return df
     st.markdown("#### Filtros da Tabela")
@@ -169,6 +173,7 @@ st.title("🚚 Gestão de Frota")
 PAGES = [
     "Dashboard",
     "Veículos",
+    "Detalhe do Veículo",
     "Motoristas",
     "Abastecimentos",
     "Viagens",
@@ -199,9 +204,8 @@ def editor_delete_update(df, table, keycol, editable_map, column_config=None, ke
     from streamlit import column_config as cc
     import pandas as pd
 
-    df = df.copy()
-    if "Excluir" not in df.columns:
-        df.insert(0, "Excluir", False)
+    # Coluna "Excluir" anexada sem copiar os dados de df
+    view = pd.concat([pd.DataFrame({"Excluir": False}, index=df.index), df], axis=1, copy=False)
 
     cfg = column_config.copy() if isinstance(column_config, dict) else {}
     cfg["Excluir"] = cc.CheckboxColumn("🗑️", help="Marque para excluir", default=False)
@@ -215,7 +219,7 @@ def editor_delete_update(df, table, keycol, editable_map, column_config=None, ke
         pass
 
     edited = st.data_editor(
-        df,
+        view,
         hide_index=True,
         use_container_width=True,
         column_config=cfg,
@@ -235,17 +239,16 @@ def editor_delete_update(df, table, keycol, editable_map, column_config=None, ke
             st.experimental_rerun()
 
     if csave.button("Salvar alterações", key=f"{key_prefix}_save"):
-        # Remove coluna Excluir antes de comparar
-        orig = df.drop(columns=["Excluir"])
-        cur = edited.drop(columns=["Excluir"])
+        # Compara com df original (a coluna Excluir não está em editable_map)
+        pos = {k: i for i, k in enumerate(df[keycol])}
 
         updates = 0
-        for _, row in cur.iterrows():
+        errors = []
+        for _, row in edited.iterrows():
             keyval = row[keycol]
-            base = orig[orig[keycol] == keyval]
-            if base.empty:
+            if keyval not in pos:
                 continue
-            base_row = base.iloc[0]
+            base_row = df.iloc[pos[keyval]]
 
             changed_pairs = []
             for col_df, col_db in editable_map.items():
@@ -257,12 +260,19 @@ def editor_delete_update(df, table, keycol, editable_map, column_config=None, ke
                     changed_pairs.append((col_db, val_new))
 
             if changed_pairs:
-                set_clause = ", ".join([f"{c}=?" for c,_ in changed_pairs])
-                params = [v for _,v in changed_pairs] + [int(keyval) if keycol=='id' else keyval]
-                execute(f"UPDATE {table} SET {set_clause} WHERE {keycol}=?", tuple(params))
+                try:
+                    update_row(table, keycol, int(keyval) if keycol=='id' else keyval, dict(changed_pairs))
+                except OdometerError as e:
+                    errors.append(str(e))
+                    continue
                 updates += 1
 
         st.success(f"Atualizadas {updates} linha(s).")
+        if errors:
+            # mantém a mensagem visível: sem rerun, o editor segue com os valores recusados
+            for e in errors:
+                st.error(e)
+            return
         try:
             st.rerun()
         except Exception:
@@ -278,27 +288,35 @@ if page == "Dashboard":
     st.subheader("Painel Geral")
 
     # --- Filtros do Dashboard ---
-    plates_all = ["Todas"] + fetch_df("SELECT plate FROM vehicles ORDER BY plate")["plate"].tolist()
+    base = fetch_many({
+        "plates": "SELECT plate FROM vehicles ORDER BY plate",
+        "years": "SELECT DISTINCT month_key / 100 AS y FROM date_periods ORDER BY y",
+        "n_veic": "SELECT COUNT(*) AS n FROM vehicles",
+        "n_driv": "SELECT COUNT(*) AS n FROM drivers",
+    })
+    plates_all = ["Todas"] + base["plates"]["plate"].tolist()
     cflt1, cflt2, cflt3 = st.columns([2,1,1])
     f_placa = cflt1.selectbox("Placa (filtro)", plates_all, index=0)
-    dates_union = fetch_df("SELECT date FROM fuels UNION SELECT date FROM costs UNION SELECT date FROM trips")
-    if dates_union.empty:
-        years = [date.today().year]
-    else:
-        years = sorted(pd.to_datetime(dates_union["date"], errors="coerce").dropna().dt.year.unique().tolist()) or [date.today().year]
+    years = base["years"]["y"].tolist() or [date.today().year]
     f_ano = cflt2.selectbox("Ano", years, index=years.index(date.today().year) if date.today().year in years else 0)
     f_mes = cflt3.selectbox("Mês", list(range(1,13)), index=date.today().month-1)
-    ym = f"{f_ano}-{f_mes:02d}"
+    ym = f_ano * 100 + f_mes
     plate_sql = "" if f_placa == "Todas" else " AND plate = ?"
     params = (ym,) if f_placa == "Todas" else (ym, f_placa)
 
-    # --- Métricas ---
+    # --- Métricas (consultas do mês em paralelo) ---
+    month = fetch_many({
+        "fuel": ("SELECT IFNULL(SUM(liters),0) AS litros, IFNULL(SUM(total),0) AS total FROM fuels WHERE month_key=?" + plate_sql, params),
+        "costs": ("SELECT IFNULL(SUM(amount),0) AS s FROM costs WHERE month_key=?" + plate_sql, params),
+        "rev": ("SELECT IFNULL(SUM(revenue),0) AS s FROM trips WHERE month_key=?" + plate_sql, params),
+        "chart": ("SELECT day_key, SUM(total) AS total FROM fuels WHERE month_key=?" + plate_sql + " GROUP BY day_key ORDER BY day_key", params),
+    })
     col1, col2, col3, col4 = st.columns(4)
-    total_veic = fetch_df("SELECT COUNT(*) AS n FROM vehicles")["n"].iloc[0]
-    total_driv = fetch_df("SELECT COUNT(*) AS n FROM drivers")["n"].iloc[0]
-    litros_mes = fetch_df("SELECT IFNULL(SUM(liters),0) AS s FROM fuels WHERE substr(date,1,7)=?" + plate_sql, params)["s"].iloc[0]
-    comb_mes = fetch_df("SELECT IFNULL(SUM(total),0) AS s FROM fuels WHERE substr(date,1,7)=?" + plate_sql, params)["s"].iloc[0]
-    custos_mes = fetch_df("SELECT IFNULL(SUM(amount),0) AS s FROM costs WHERE substr(date,1,7)=?" + plate_sql, params)["s"].iloc[0]
+    total_veic = base["n_veic"]["n"].iloc[0]
+    total_driv = base["n_driv"]["n"].iloc[0]
+    litros_mes = month["fuel"]["litros"].iloc[0]
+    comb_mes = month["fuel"]["total"].iloc[0]
+    custos_mes = month["costs"]["s"].iloc[0]
 
     col1.metric("Veículos", int(total_veic))
     col2.metric("Motoristas", int(total_driv))
@@ -310,7 +328,7 @@ if page == "Dashboard":
 
     st.markdown("---")
     st.subheader("Receitas e Despesas do Mês")
-    rev = fetch_df("SELECT IFNULL(SUM(revenue),0) AS s FROM trips WHERE substr(date,1,7)=?" + plate_sql, params)["s"].iloc[0]
+    rev = month["rev"]["s"].iloc[0]
     despesas = float(custos_mes) + float(comb_mes)
     resultado = float(rev) - despesas
     mc1, mc2, mc3 = st.columns(3)
@@ -321,10 +339,10 @@ if page == "Dashboard":
 
     st.markdown("---")
     st.subheader("Gráfico do mês")
-    df_fuel = fetch_df("SELECT date, total FROM fuels WHERE substr(date,1,7)=?" + plate_sql, params)
-    if not df_fuel.empty:
-        df_fuel["dia"] = pd.to_datetime(df_fuel["date"]).dt.strftime("%d/%m/%Y")
-        grp = df_fuel.groupby("dia")["total"].sum().reset_index().sort_values("dia")
+    grp = month["chart"]
+    if not grp.empty:
+        grp["dia"] = [f"{k % 100:02d}/{f_mes:02d}/{f_ano}" for k in grp["day_key"]]
+        grp = grp[["dia", "total"]]
         st.markdown("**Gasto com combustível por dia (R$)**")
         st.bar_chart(grp.set_index("dia"))
     else:
@@ -361,7 +379,8 @@ elif page == "Veículos":
                 """, (plate, model, int(year), fuel, float(tank), owner, status, color, notes))
                 st.success("Veículo salvo com sucesso!")
 
-        df = fetch_df("SELECT plate, model, year, fuel_type, tank_l, owner, status, color, notes FROM vehicles ORDER BY plate")
+        df = fetch_typed_df("SELECT plate, model, year, fuel_type, tank_l, owner, status, color, notes FROM vehicles ORDER BY plate",
+                            categories={"status": status_opts, "fuel_type": fuel_opts})
     if not df.empty:
         df = filter_table(df, "flt_veh")
         editor_delete_update(
@@ -381,6 +400,67 @@ elif page == "Veículos":
         st.info("Sem registros.")
     df_download_button(df, "⬇️ Exportar veículos (CSV)", "veiculos.csv")
 
+# ---------- Detalhe do Veículo ----------
+elif page == "Detalhe do Veículo":
+    st.subheader("Detalhe do Veículo (custo total de propriedade)")
+    veics = fetch_df("SELECT plate FROM vehicles ORDER BY plate")["plate"].tolist()
+    if not veics:
+        st.info("Cadastre veículos primeiro.")
+    else:
+        plate = st.selectbox("Placa", veics)
+        refresh_ledger()
+
+        def per_km(v):
+            return "—" if pd.isna(v) else brl(v) + "/km"
+
+        def km(v):
+            return "—" if pd.isna(v) else f"{v:,.0f} km".replace(",", ".")
+
+        summ = vehicle_summary(plate)
+        if summ.empty:
+            st.info("Sem lançamentos para esta placa.")
+        else:
+            s = summ.iloc[0]
+            st.markdown("**Vida toda**")
+            c1, c2, c3, c4, c5 = st.columns(5)
+            c1.metric("Custos", brl(s["lifetime_cost"]))
+            c2.metric("Receitas", brl(s["lifetime_revenue"]))
+            c3.metric("Km rodados", km(s["lifetime_km"]))
+            c4.metric("Custo/km", per_km(s["cost_per_km"]))
+            c5.metric("Receita/km", per_km(s["revenue_per_km"]))
+            st.markdown("**Últimos 12 meses**")
+            c1, c2, c3, c4, c5 = st.columns(5)
+            c1.metric("Custos", brl(s["ttm_cost"]))
+            c2.metric("Receitas", brl(s["ttm_revenue"]))
+            c3.metric("Km rodados", km(s["ttm_km"]))
+            c4.metric("Custo/km", per_km(s["ttm_cost_per_km"]))
+            c5.metric("Receita/km", per_km(s["ttm_revenue_per_km"]))
+            st.caption("Km calculado pelas leituras de hodômetro (abastecimentos e km final das viagens).")
+
+        st.markdown("---")
+        st.subheader("Extrato do veículo")
+        led = vehicle_ledger(plate)
+        if not led.empty:
+            led["source"] = led["source"].map({
+                "fuels": "Abastecimento", "maints": "Manutenção", "costs": "Custo", "trips": "Frete",
+            })
+            st.dataframe(
+                led,
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    "date": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
+                    "source": "Origem",
+                    "description": "Descrição",
+                    "amount": st.column_config.NumberColumn("Valor (R$)", format="R$ %.2f"),
+                    "odometer": st.column_config.NumberColumn("Hodômetro"),
+                    "balance": st.column_config.NumberColumn("Saldo (R$)", format="R$ %.2f"),
+                },
+            )
+            df_download_button(led, "⬇️ Exportar extrato (CSV)", f"extrato_{plate}.csv")
+        else:
+            st.info("Sem registros.")
+
 # ---------- Motoristas ----------
 elif page == "Motoristas":
     st.subheader("Cadastro de Motoristas")
@@ -404,9 +484,8 @@ elif page == "Motoristas":
                 """, (name, cnh, cat, expiry.strftime("%Y-%m-%d"), phone, notes))
                 st.success("Motorista salvo!")
 
-        df = fetch_df("SELECT id, name, cnh, cnh_category, cnh_expiry, phone, notes FROM drivers ORDER BY name")
+        df = fetch_typed_df("SELECT id, name, cnh, cnh_category, cnh_expiry, phone, notes FROM drivers ORDER BY name", date_cols=("cnh_expiry",))
     if not df.empty:
-        df["cnh_expiry"] = pd.to_datetime(df["cnh_expiry"], errors="coerce").dt.date
         df = filter_table(df, "flt_drivers")
         editor_delete_update(
             df,
@@ -452,22 +531,25 @@ elif page == "Abastecimentos":
                 st.warning("Cadastre veículos e motoristas primeiro.")
             else:
                 total = liters * unit_price
-                execute("""
-                    INSERT INTO fuels (date, plate, driver_id, station, liters, unit_price, total, odometer, payment, notes)
-                    VALUES (?,?,?,?,?,?,?,?,?,?)
-                """, (d.strftime("%Y-%m-%d"), plate, drivers.get(drv_name), station, liters, unit_price, total, odom, pay, notes))
-                st.success("Abastecimento salvo! Total calculado: R$ {:.2f}".format(total))
-
-        df = fetch_df("""
-        SELECT f.id, f.date AS data, f.plate AS placa, d.name AS motorista, f.station AS posto,
+                try:
+                    insert_row("fuels", {
+                        "date": d.strftime("%Y-%m-%d"), "plate": plate, "driver_id": drivers.get(drv_name),
+                        "station": station, "liters": liters, "unit_price": unit_price, "total": total,
+                        "odometer": odom, "payment": pay, "notes": notes,
+                    })
+                    st.success("Abastecimento salvo! Total calculado: R$ {:.2f}".format(total))
+                except OdometerError as e:
+                    st.error(str(e))
+
+        df = fetch_typed_df("""
+        SELECT f.id, f.day_key AS data, f.plate AS placa, d.name AS motorista, f.station AS posto,
                f.liters AS litros, f.unit_price AS preco, f.total, f.odometer AS hodometro,
                f.payment AS pagamento, f.notes AS obs
         FROM fuels f
         LEFT JOIN drivers d ON d.id = f.driver_id
         ORDER BY f.date DESC, f.id DESC
-    """)
+    """, date_cols=("data",), categories={"placa": veics, "posto": stations, "pagamento": payments})
     if not df.empty:
-        df["data"] = pd.to_datetime(df["data"], errors="coerce").dt.date
         df = filter_table(df, "flt_fuels")
         editor_delete_update(
             df,
@@ -514,15 +596,14 @@ elif page == "Viagens":
             """, (d.strftime("%Y-%m-%d"), plate, drivers.get(drv_name), client, notes, freight, nfe))
             st.success("Viagem salva!")
 
-        df = fetch_df("""
-        SELECT t.id, t.date AS data, t.plate AS placa, d.name AS motorista,
+        df = fetch_typed_df("""
+        SELECT t.id, t.day_key AS data, t.plate AS placa, d.name AS motorista,
                t.nfe, t.client AS cliente, t.revenue AS frete, t.notes AS obs
         FROM trips t
         LEFT JOIN drivers d ON d.id = t.driver_id
         ORDER BY t.date DESC, t.id DESC
-    """)
+    """, date_cols=("data",), categories={"placa": veics})
     if not df.empty:
-        df["data"] = pd.to_datetime(df["data"], errors="coerce").dt.date
         df = filter_table(df, "flt_trips")
         editor_delete_update(
             df,
@@ -566,15 +647,14 @@ elif page == "Custos":
             """, (d.strftime("%Y-%m-%d"), plate, ctype, desc, amount, "", drivers.get(drv_name)))
             st.success("Custo salvo!")
 
-        df = fetch_df("""
-        SELECT c.id, c.date AS data, c.plate AS placa, c.ctype AS tipo,
+        df = fetch_typed_df("""
+        SELECT c.id, c.day_key AS data, c.plate AS placa, c.ctype AS tipo,
                c.description AS descricao, c.amount AS valor, d.name AS motorista
         FROM costs c
         LEFT JOIN drivers d ON d.id = c.driver_id
         ORDER BY c.date DESC, c.id DESC
-    """)
+    """, date_cols=("data",), categories={"placa": veics, "tipo": ctypes})
     if not df.empty:
-        df["data"] = pd.to_datetime(df["data"], errors="coerce").dt.date
         df = filter_table(df, "flt_costs")
         editor_delete_update(
             df,
@@ -627,6 +707,50 @@ elif page == "Parâmetros":
         st.info("Sem registros.")
 
     
+    # Hodômetro
+    st.markdown("---")
+    st.subheader("Consistência de hodômetro")
+    if st.button("Revalidar histórico de hodômetro", key="odo_check"):
+        flags = revalidate_odometers()
+        if flags.empty:
+            st.success("Nenhuma leitura fora de ordem.")
+        else:
+            st.warning(f"{len(flags)} leitura(s) fora de ordem.")
+            st.dataframe(flags, hide_index=True, use_container_width=True)
+
     # Backup
     st.markdown("---")
-    st.info("Backup do banco (fleet.db) pode ser feito copiando o arquivo do diretório do projeto.")
+    st.subheader("Backups (snapshots)")
+    status = backup_status()
+    if status["last_run"]:
+        st.caption(f"Último snapshot: {status['last_run']:%d/%m/%Y %H:%M:%S}")
+    if status["last_restore"]:
+        name, when = status["last_restore"]
+        st.caption(f"Última restauração: {name} em {when:%d/%m/%Y %H:%M:%S}")
+    if status["pending_restore"]:
+        st.info("Restauração em andamento...")
+    if status["last_error"]:
+        st.warning(f"Falha no último backup: {status['last_error']}")
+    if DROPBOX_ENABLED:
+        up = upload_status()
+        if up["last_ok"]:
+            st.caption(f"Último envio ao Dropbox: {up['last_ok']:%d/%m/%Y %H:%M:%S}")
+        if up["last_error"]:
+            st.warning(f"Falha no envio ao Dropbox ({up['failures']} tentativa(s); "
+                       f"novas tentativas em segundo plano): {up['last_error']}")
+
+    if st.button("Gerar snapshot agora", key="bkp_now"):
+        request_snapshot()
+        st.success("Snapshot solicitado; ele será gerado em segundo plano.")
+
+    snaps = list_snapshots()
+    if snaps:
+        labels = {name: t.strftime("%d/%m/%Y %H:%M:%S") for name, t in snaps}
+        snap = st.selectbox("Restaurar para o ponto", list(labels.keys()), format_func=labels.get, key="bkp_sel")
+        confirm = st.checkbox("Confirmo que os dados atuais serão substituídos por este snapshot", key="bkp_confirm")
+        if st.button("Restaurar snapshot", key="bkp_restore", disabled=not confirm):
+            request_restore(snap)
+            st.success(f"Restauração para {labels[snap]} solicitada; ela roda em segundo plano, "
+                       "depois de guardar um snapshot do estado atual.")
+    else:
+        st.info("Nenhum snapshot disponível ainda.")
@@ -0,0 +1,261 @@
+# backup.py
+"""Snapshots pontuais do fleet.db com política de retenção.
+
+Os snapshots são feitos com a API de backup do SQLite (cópia consistente, em
+passos curtos, sem travar quem está gravando), comprimidos com gzip e enviados
+para o Dropbox (pasta ``snapshots`` ao lado do ``path`` configurado) ou, sem
+Dropbox, para a pasta local ``backups/``.
+
+Todo o trabalho de backup roda numa thread em segundo plano; as páginas só
+acordam essa thread (``request_snapshot``) e nunca geram snapshots durante o
+rerun do Streamlit.
+"""
+import gzip
+import os
+import posixpath
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+
+import streamlit as st
+
+import db
+
+# Configuração opcional em secrets:
+# [backup]
+# interval_min = 60
+# keep_hourly = 24
+# keep_daily = 30
+# keep_monthly = 12
+_CFG = st.secrets["backup"] if db.has_secret("backup") else {}
+INTERVAL_MIN = int(_CFG.get("interval_min", 60))
+KEEP_HOURLY = int(_CFG.get("keep_hourly", 24))
+KEEP_DAILY = int(_CFG.get("keep_daily", 30))
+KEEP_MONTHLY = int(_CFG.get("keep_monthly", 12))
+
+SNAP_PREFIX = "fleet-"
+SNAP_SUFFIX = ".db.gz"
+SNAP_FMT = "%Y%m%d-%H%M%S"
+LOCAL_BACKUP_DIR = "backups"
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_state = {"last_run": None, "last_error": None, "pending_restore": None, "last_restore": None}
+# snapshots envolvidos numa restauração (o restaurado e o do estado anterior):
+# ficam fora da retenção enquanto o processo estiver no ar
+_pinned = set()
+
+
+# ---------- nomes ----------
+def snapshot_name(ts):
+    return f"{SNAP_PREFIX}{ts.strftime(SNAP_FMT)}{SNAP_SUFFIX}"
+
+def snapshot_time(name):
+    """Data/hora do snapshot a partir do nome (None se não for um snapshot)."""
+    if not (name.startswith(SNAP_PREFIX) and name.endswith(SNAP_SUFFIX)):
+        return None
+    try:
+        return datetime.strptime(name[len(SNAP_PREFIX):-len(SNAP_SUFFIX)], SNAP_FMT)
+    except ValueError:
+        return None
+
+
+# ---------- armazenamento (Dropbox ou pasta local) ----------
+def _remote_dir():
+    return posixpath.join(posixpath.dirname(db.DROPBOX_PATH) or "/", "snapshots")
+
+def _list_names():
+    if db.DROPBOX_ENABLED:
+        try:
+            res = db.DBX.files_list_folder(_remote_dir())
+        except Exception:
+            # pasta ainda não existe => nenhum snapshot
+            return []
+        names = [e.name for e in res.entries]
+        while res.has_more:
+            res = db.DBX.files_list_folder_continue(res.cursor)
+            names += [e.name for e in res.entries]
+        return names
+    if not os.path.isdir(LOCAL_BACKUP_DIR):
+        return []
+    return os.listdir(LOCAL_BACKUP_DIR)
+
+# Snapshots circulam como arquivos (nunca o banco inteiro em memória).
+def _put(name, path):
+    if db.DROPBOX_ENABLED:
+        mode = db.dropbox.files.WriteMode("overwrite")
+        with open(path, "rb") as f:
+            db.DBX.files_upload(f, posixpath.join(_remote_dir(), name), mode=mode, mute=True)
+        return
+    os.makedirs(LOCAL_BACKUP_DIR, exist_ok=True)
+    shutil.copyfile(path, os.path.join(LOCAL_BACKUP_DIR, name))
+
+def _get(name, path):
+    if db.DROPBOX_ENABLED:
+        db.DBX.files_download_to_file(path, posixpath.join(_remote_dir(), name))
+        return
+    shutil.copyfile(os.path.join(LOCAL_BACKUP_DIR, name), path)
+
+def _delete(name):
+    if db.DROPBOX_ENABLED:
+        db.DBX.files_delete_v2(posixpath.join(_remote_dir(), name))
+        return
+    os.remove(os.path.join(LOCAL_BACKUP_DIR, name))
+
+def list_snapshots():
+    """Lista [(nome, datetime)] do mais recente para o mais antigo."""
+    snaps = [(n, snapshot_time(n)) for n in _list_names()]
+    return sorted([s for s in snaps if s[1] is not None], key=lambda s: s[1], reverse=True)
+
+
+# ---------- retenção ----------
+def retained(stamps):
+    """Escolhe quais datas manter: o último snapshot de cada uma das
+    KEEP_HOURLY horas, KEEP_DAILY dias e KEEP_MONTHLY meses mais recentes."""
+    stamps = sorted(stamps, reverse=True)
+    keep = set(stamps[:1])
+    for count, bucket in (
+        (KEEP_HOURLY, lambda t: (t.year, t.month, t.day, t.hour)),
+        (KEEP_DAILY, lambda t: (t.year, t.month, t.day)),
+        (KEEP_MONTHLY, lambda t: (t.year, t.month)),
+    ):
+        seen = set()
+        for t in stamps:
+            b = bucket(t)
+            if b in seen:
+                continue
+            seen.add(b)
+            if len(seen) > count:
+                break
+            keep.add(t)
+    return keep
+
+def prune_snapshots():
+    snaps = list_snapshots()
+    keep = retained([t for _, t in snaps])
+    removed = 0
+    for name, t in snaps:
+        if t not in keep and name not in _pinned:
+            _delete(name)
+            removed += 1
+    return removed
+
+
+# ---------- snapshot / restauração ----------
+def _tempfile(suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+def _backup_to_file(path):
+    src = db.get_conn()
+    dst = sqlite3.connect(path)
+    try:
+        # Copia em passos curtos: os escritores só esperam por um passo.
+        src.backup(dst, pages=256, sleep=0.01)
+    finally:
+        dst.close()
+        src.close()
+
+def take_snapshot(force=False, pin=False):
+    """Gera um snapshot comprimido e aplica a retenção.
+    Sem ``force``, não faz nada se o banco não mudou desde o último snapshot.
+    Com ``pin``, o novo snapshot fica fora da retenção (ver _pinned)."""
+    with _lock:
+        if not os.path.exists(db.DB_PATH):
+            return None
+        now = datetime.now()
+        last = _state["last_run"]
+        if not force and last and os.path.getmtime(db.DB_PATH) <= last.timestamp():
+            return None
+        name = snapshot_name(now)
+        tmp = _tempfile(".db")
+        gz = _tempfile(SNAP_SUFFIX)
+        try:
+            _backup_to_file(tmp)
+            # comprime em blocos, de arquivo para arquivo
+            with open(tmp, "rb") as src, gzip.open(gz, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(tmp)
+            _put(name, gz)
+        finally:
+            for f in (tmp, gz):
+                if os.path.exists(f):
+                    os.remove(f)
+        if pin:
+            _pinned.add(name)
+        _state["last_run"] = now
+        prune_snapshots()
+        return name
+
+def restore_snapshot(name):
+    """Restaura o banco para o snapshot ``name`` (um snapshot do estado atual
+    é gravado antes, para permitir desfazer). Roda na thread de backup; as
+    páginas usam request_restore."""
+    gz = _tempfile(SNAP_SUFFIX)
+    tmp = _tempfile(".db")
+    try:
+        try:
+            _get(name, gz)
+            # descomprime em blocos, de arquivo para arquivo
+            with gzip.open(gz, "rb") as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        finally:
+            os.remove(gz)
+        _pinned.add(name)
+        take_snapshot(force=True, pin=True)
+        with _lock:
+            src = sqlite3.connect(tmp)
+            dst = db.get_conn()
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+    finally:
+        os.remove(tmp)
+    _state["last_restore"] = (name, datetime.now())
+    db._request_upload()
+
+
+# ---------- agendador ----------
+def _loop():
+    force = False
+    while True:
+        try:
+            restore = _state["pending_restore"]
+            if restore:
+                try:
+                    restore_snapshot(restore)
+                finally:
+                    _state["pending_restore"] = None
+            else:
+                take_snapshot(force=force)
+            _state["last_error"] = None
+        except Exception as e:
+            _state["last_error"] = f"{datetime.now():%d/%m/%Y %H:%M}: {e}"
+        # acorda no próximo intervalo ou antes, se uma página pedir snapshot
+        # ou restauração (pedidos feitos durante o trabalho já deixam _wake ligado)
+        force = _wake.wait(INTERVAL_MIN * 60)
+        _wake.clear()
+
+@st.cache_resource(show_spinner=False)
+def start_backup_scheduler():
+    """Inicia (uma vez por processo) a thread de snapshots."""
+    t = threading.Thread(target=_loop, name="fleet-backup", daemon=True)
+    t.start()
+    return t
+
+def request_snapshot():
+    """Pede um snapshot imediato à thread de backup (não bloqueia a página)."""
+    _wake.set()
+
+def request_restore(name):
+    """Pede à thread de backup a restauração de ``name`` (não bloqueia a página)."""
+    _state["pending_restore"] = name
+    _wake.set()
+
+def backup_status():
+    return dict(_state)
@@ -1,12 +1,24 @@
 # db.py
+import atexit
+import glob
 import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+def has_secret(key):
+    # sem secrets.toml (uso local ou serviços sem UI, ex.: ingest.py) => False,
+    # sem o st.error que o acesso direto a st.secrets exibiria
+    return st.secrets.load_if_toml_exists() and key in st.secrets
+
 # --- Dropbox SDK (opcionalmente com refresh token) ---
-DROPBOX_ENABLED = "dropbox" in st.secrets
+DROPBOX_ENABLED = has_secret("dropbox")
 if DROPBOX_ENABLED:
     import dropbox
     if "refresh_token" in st.secrets["dropbox"]:
@@ -35,16 +47,79 @@ def _download_from_dropbox_if_exists():
         return False
 
 def _upload_to_dropbox():
+    """Envia o banco ao Dropbox; falhas sobem para quem chamou."""
     if not DROPBOX_ENABLED or not os.path.exists(DB_PATH):
         return
-    with open(DB_PATH, "rb") as f:
-        data = f.read()
+    # Envia uma cópia consistente (a réplica atual, se nada foi gravado depois
+    # dela, ou uma nova geração) em vez de ler o arquivo que recebe gravações.
+    if REPLICA_MAX_STALENESS_S > 0:
+        try:
+            with open(_current_replica() or refresh_replica(), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # a geração foi removida pela limpeza entre a escolha e a leitura
+            with open(refresh_replica(), "rb") as f:
+                data = f.read()
+    else:
+        with open(DB_PATH, "rb") as f:
+            data = f.read()
     mode = dropbox.files.WriteMode("overwrite")
-    try:
-        DBX.files_upload(data, DROPBOX_PATH, mode=mode, mute=True)
-    except Exception as e:
-        # Mostra um aviso leve no app, mas não quebra a experiência
-        st.warning("Falha ao enviar banco ao Dropbox. Tente novamente.")
+    DBX.files_upload(data, DROPBOX_PATH, mode=mode, mute=True)
+
+# Envios ao Dropbox rodam numa thread própria. "dirty" só é desligado por um
+# envio bem-sucedido; a página de Parâmetros mostra upload_status().
+UPLOAD_RETRY_MAX_S = 300
+_upload_state = {"dirty": False, "last_ok": None, "last_error": None, "failures": 0}
+_upload_wake = threading.Event()
+_upload_thread = None
+_upload_lock = threading.Lock()
+_upload_run_lock = threading.Lock()
+
+def _flush_upload():
+    """Envia o banco se houver gravações ainda não enviadas (True => em dia)."""
+    with _upload_run_lock:
+        if not _upload_state["dirty"]:
+            return True
+        # gravações feitas durante o envio voltam a marcar o banco como sujo
+        _upload_state["dirty"] = False
+        try:
+            _upload_to_dropbox()
+        except Exception as e:
+            _upload_state["dirty"] = True
+            _upload_state["failures"] += 1
+            _upload_state["last_error"] = f"{datetime.now():%d/%m/%Y %H:%M}: {e}"
+            return False
+        _upload_state.update(last_ok=datetime.now(), last_error=None, failures=0)
+        return True
+
+def _upload_loop():
+    while True:
+        _upload_wake.wait()
+        _upload_wake.clear()
+        while not _flush_upload():
+            # espera crescente entre tentativas (2, 4, 8... s, até UPLOAD_RETRY_MAX_S)
+            time.sleep(min(UPLOAD_RETRY_MAX_S, 2 ** _upload_state["failures"]))
+
+def _request_upload():
+    """Agenda o envio ao Dropbox numa thread própria, fora do rerun das
+    páginas. Gravações feitas durante um envio viram um único envio seguinte."""
+    global _upload_thread
+    if not DROPBOX_ENABLED:
+        return
+    _upload_state["dirty"] = True
+    with _upload_lock:
+        if _upload_thread is None:
+            _upload_thread = threading.Thread(target=_upload_loop, name="fleet-dropbox", daemon=True)
+            _upload_thread.start()
+    _upload_wake.set()
+
+def _flush_upload_at_exit():
+    # melhor esforço: a thread de envio é daemon e morre com o processo
+    if _upload_state["dirty"]:
+        _flush_upload()
+
+def upload_status():
+    return dict(_upload_state)
 
 def ensure_local_db_is_restored():
     """Se não houver DB local, tenta restaurar do Dropbox."""
@@ -164,11 +239,144 @@ def init_db():
     """)
 
     conn.commit()
+    migrate_dates(conn)
+    init_odometer_checks(conn)
     conn.close()
 
     # 2) garante que há cópia inicial no Dropbox
     if DROPBOX_ENABLED:
-        _upload_to_dropbox()
+        _request_upload()
+
+# ---------- Datas normalizadas ----------
+# Tabelas com coluna `date`; cada uma ganha day_key (AAAAMMDD) e month_key
+# (AAAAMM) inteiros, mantidos por triggers. `date_periods` guarda quantas
+# linhas existem por mês, para os seletores de período não lerem as tabelas.
+DATED_TABLES = ("fuels", "trips", "costs", "maints")
+
+def _table_columns(cur, table):
+    return {r[1] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()}
+
+def parse_dates(s):
+    """Converte uma Series de datas em texto (ISO ou dd/mm/AAAA) para datetime64."""
+    dt = pd.to_datetime(s, format="ISO8601", errors="coerce")
+    missing = dt.isna() & s.notna()
+    if missing.any():
+        dt[missing] = pd.to_datetime(s[missing], format="%d/%m/%Y", errors="coerce")
+    return dt
+
+def date_keys(dt):
+    """(day_key, month_key) inteiros a partir de uma Series datetime64."""
+    day = dt.dt.year * 10000 + dt.dt.month * 100 + dt.dt.day
+    return day.astype("Int64"), (day // 100).astype("Int64")
+
+def day_key_dates(k):
+    """Series de day_key (AAAAMMDD) -> datetime64 só com aritmética de inteiros
+    (sem parse de texto). Nulo/0 => NaT."""
+    v = k.to_numpy(dtype="float64", na_value=np.nan)
+    ok = v > 0
+    i = np.where(ok, v, 19700101).astype("int64")
+    month = ((i // 10000 - 1970) * 12 + i // 100 % 100 - 1).astype("datetime64[M]")
+    d = (month.astype("datetime64[D]") + (i % 100 - 1).astype("timedelta64[D]")).astype("datetime64[ns]")
+    d[~ok] = np.datetime64("NaT")
+    return pd.Series(d, index=k.index, name=k.name)
+
+def iso_date(v):
+    """Data (ISO ou dd/mm/AAAA, texto ou date) como AAAA-MM-DD; ValueError se inválida."""
+    if hasattr(v, "strftime"):
+        return v.strftime("%Y-%m-%d")
+    v = str(v).strip()
+    try:
+        return datetime.fromisoformat(v).strftime("%Y-%m-%d")
+    except ValueError:
+        try:
+            return datetime.strptime(v, "%d/%m/%Y").strftime("%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f"data inválida: {v!r}")
+
+def _normalize_date(table, row):
+    """Copia de row com `date` em ISO (tabelas de DATED_TABLES)."""
+    if table not in DATED_TABLES or not row.get("date"):
+        return row
+    return dict(row, date=iso_date(row["date"]))
+
+def _date_triggers(cur, t):
+    day = "CAST(strftime('%Y%m%d', NEW.date) AS INTEGER)"
+    month = "CAST(strftime('%Y%m', NEW.date) AS INTEGER)"
+    inc = f"""
+        INSERT INTO date_periods (month_key, n) SELECT {month}, 1 WHERE {month} IS NOT NULL
+        ON CONFLICT(month_key) DO UPDATE SET n = n + 1;"""
+    dec = """
+        UPDATE date_periods SET n = n - 1 WHERE month_key = OLD.month_key;
+        DELETE FROM date_periods WHERE n <= 0;"""
+    cur.executescript(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_date_ins AFTER INSERT ON {t}
+    BEGIN
+        UPDATE {t} SET day_key = {day}, month_key = {month} WHERE id = NEW.id;{inc}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_date_upd AFTER UPDATE OF date ON {t}
+    BEGIN{dec}
+        UPDATE {t} SET day_key = {day}, month_key = {month} WHERE id = NEW.id;{inc}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_date_del AFTER DELETE ON {t}
+    BEGIN{dec}
+    END;
+    """)
+
+def _date_checks(cur, t):
+    """Recusa datas fora do ISO gravadas por SQL direto (ex.: execute), que
+    ficariam sem day_key/month_key. insert_many/update_row já normalizam."""
+    bad = "NEW.date IS NOT NULL AND NEW.date <> '' AND strftime('%Y%m%d', NEW.date) IS NULL"
+    fail = f"SELECT RAISE(ABORT, 'data inválida em {t}: use AAAA-MM-DD');"
+    cur.executescript(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_date_chk_ins BEFORE INSERT ON {t}
+    WHEN {bad} BEGIN {fail} END;
+    CREATE TRIGGER IF NOT EXISTS trg_{t}_date_chk_upd BEFORE UPDATE OF date ON {t}
+    WHEN {bad} BEGIN {fail} END;
+    """)
+
+def migrate_dates(conn):
+    """Migração única (por tabela): corrige datas dd/mm/AAAA para ISO,
+    preenche day_key/month_key de forma vetorizada, cria índice e triggers
+    e reconstrói `date_periods`. Em bancos já migrados só lê o schema (e
+    garante os triggers de _date_checks)."""
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS date_periods (
+        month_key INTEGER PRIMARY KEY,
+        n INTEGER NOT NULL
+    );
+    """)
+    migrated = False
+    for t in DATED_TABLES:
+        cols = _table_columns(cur, t)
+        if not cols:
+            continue
+        if "day_key" in cols:
+            _date_checks(cur, t)
+            continue
+        cur.execute(f"ALTER TABLE {t} ADD COLUMN day_key INTEGER")
+        cur.execute(f"ALTER TABLE {t} ADD COLUMN month_key INTEGER")
+        df = pd.read_sql_query(f"SELECT id, date FROM {t}", conn)
+        dt = parse_dates(df["date"])
+        day, month = date_keys(dt)
+        iso = dt.dt.strftime("%Y-%m-%d").where(dt.notna(), df["date"])
+        rows = zip(iso.tolist(), day.astype(object).where(day.notna(), None).tolist(),
+                   month.astype(object).where(month.notna(), None).tolist(), df["id"].tolist())
+        cur.executemany(f"UPDATE {t} SET date=?, day_key=?, month_key=? WHERE id=?", rows)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_month_plate ON {t}(month_key, plate)")
+        _date_triggers(cur, t)
+        _date_checks(cur, t)
+        migrated = True
+    if migrated:
+        union = " UNION ALL ".join(
+            f"SELECT month_key FROM {t}" for t in DATED_TABLES if "month_key" in _table_columns(cur, t)
+        )
+        cur.execute("DELETE FROM date_periods")
+        cur.execute(f"""
+            INSERT INTO date_periods (month_key, n)
+            SELECT month_key, COUNT(*) FROM ({union}) WHERE month_key IS NOT NULL GROUP BY month_key
+        """)
+    conn.commit()
 
 def fetch_df(query, params=()):
     conn = get_conn()
@@ -176,36 +384,471 @@ def fetch_df(query, params=()):
     conn.close()
     return df
 
-def execute(query, params=()):
-    """INSERT/UPDATE/DELETE unitários; sincroniza após commit."""
+# Colunas de baixa cardinalidade (nomes no banco e apelidos usados nas páginas)
+CATEGORY_COLS = {
+    "plate", "placa", "station", "posto", "payment", "pagamento",
+    "ctype", "tipo", "status", "fuel_type", "category", "motorista",
+}
+
+def compact_df(df, date_cols=(), categories=None):
+    """Devolve uma versão de df com tipos compactos:
+    - colunas de CATEGORY_COLS viram ``category`` (``categories`` pode
+      acrescentar valores possíveis, ex.: {"posto": get_params("Postos")});
+    - inteiros são reduzidos ao menor tipo; floats viram float32 só quando
+      isso não perde precisão (valores em R$ continuam float64);
+    - ``date_cols`` viram datetime64 nativo: colunas inteiras são day_key
+      (AAAAMMDD, sem parse de texto); texto é lido como ISO (inválidas => NaT).
+    O DataFrame é remontado coluna a coluna para que o bloco de objetos
+    original (strings vindas do SQLite) seja liberado.
+    """
+    categories = categories or {}
+    out = {}
+    for c in df.columns:
+        s = df[c]
+        if c in date_cols:
+            if pd.api.types.is_numeric_dtype(s):
+                s = day_key_dates(s)
+            else:
+                s = pd.to_datetime(s, format="ISO8601", errors="coerce")
+        elif (c in CATEGORY_COLS or c in categories) and s.dtype == object:
+            values = set(s.dropna()) | set(categories.get(c, ()))
+            s = s.astype(pd.CategoricalDtype(sorted(values, key=str)))
+        elif pd.api.types.is_integer_dtype(s):
+            s = pd.to_numeric(s, downcast="integer")
+        elif pd.api.types.is_float_dtype(s):
+            f32 = s.astype("float32")
+            if np.array_equal(f32.to_numpy(dtype="float64"), s.to_numpy(), equal_nan=True):
+                s = f32
+        elif s.dtype == object:
+            s = s.copy()
+        out[c] = s
+    return pd.DataFrame(out, index=df.index)
+
+def fetch_typed_df(query, params=(), date_cols=(), categories=None):
+    """fetch_df com tipos compactos (ver compact_df) para listagens e caches."""
+    return compact_df(fetch_df(query, params), date_cols, categories)
+
+# ---------- Consultas paralelas (somente leitura) ----------
+READ_POOL_SIZE = 4
+_read_local = threading.local()
+_read_pool = None
+_read_pool_lock = threading.Lock()
+
+def get_read_conn():
+    """Conexão somente leitura da thread atual (reaproveitada pelo pool)."""
+    conn = getattr(_read_local, "conn", None)
+    if conn is None:
+        uri = Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        _read_local.conn = conn
+    return conn
+
+def _get_read_pool():
+    global _read_pool
+    with _read_pool_lock:
+        if _read_pool is None:
+            _read_pool = ThreadPoolExecutor(max_workers=READ_POOL_SIZE, thread_name_prefix="fleet-read")
+        return _read_pool
+
+def _read_query(query, params):
+    return pd.read_sql_query(query, get_analytics_conn(), params=params)
+
+def fetch_many(queries):
+    """Executa em paralelo consultas independentes.
+    queries: dict {nome -> sql ou (sql, params)}; devolve {nome -> DataFrame}.
+    O tempo total passa a ser o da consulta mais lenta, não a soma.
+    As consultas são analíticas: leem da réplica (ver get_analytics_conn)."""
+    pool = _get_read_pool()
+    futures = {}
+    for name, q in queries.items():
+        query, params = (q, ()) if isinstance(q, str) else q
+        futures[name] = pool.submit(_read_query, query, params)
+    return {name: f.result() for name, f in futures.items()}
+
+# ---------- Réplica de leitura ----------
+# Cópias imutáveis do fleet.db (fleet.replica.<pid>.<geração>.db) feitas com a API
+# de backup e abertas com mmap. Leituras analíticas usam a réplica enquanto
+# ela estiver dentro do limite de defasagem; depois disso caem no primário
+# (somente leitura) até uma nova geração ficar pronta em segundo plano.
+# [replica]
+# max_staleness_s = 30   # 0 desliga a réplica
+_REPLICA_CFG = st.secrets["replica"] if has_secret("replica") else {}
+REPLICA_MAX_STALENESS_S = float(_REPLICA_CFG.get("max_staleness_s", 30))
+REPLICA_MMAP_BYTES = int(_REPLICA_CFG.get("mmap_mb", 256)) * 2**20
+_replica = {"path": None, "prev": None, "gen": 0, "created": 0.0, "last_gen": 0, "refreshing": False, "mine": {}}
+_replica_lock = threading.Lock()
+
+def _replica_path(gen):
+    # o pid separa as réplicas de cada processo (app e ingest.py usam o mesmo fleet.db)
+    base, ext = os.path.splitext(DB_PATH)
+    return f"{base}.replica.{os.getpid()}.{gen}{ext}"
+
+def _cleanup_replicas(keep_current=True):
+    """Remove gerações antigas criadas por este processo; réplicas de outros
+    processos nunca são tocadas. Mantém a atual, a anterior (pode estar em
+    leitura) e cópias em andamento. Na saída do processo remove todas.
+    No Windows, arquivos ainda abertos ficam para a próxima limpeza."""
+    with _replica_lock:
+        keep = (_replica["path"], _replica["prev"])
+        old = [f for f, gen in _replica["mine"].items()
+               if not keep_current or (gen < _replica["gen"] and f not in keep)]
+    for f in old:
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue
+        with _replica_lock:
+            _replica["mine"].pop(f, None)
+
+atexit.register(_cleanup_replicas, keep_current=False)
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # no Windows os.kill(pid, 0) encerraria o processo
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # existe, mas é de outro usuário
+    return True
+
+def _sweep_orphan_replicas():
+    """Remove réplicas deixadas por processos que morreram sem passar pelo
+    atexit (kill, queda). Arquivos no formato antigo, sem pid, também saem."""
+    base, ext = os.path.splitext(DB_PATH)
+    prefix = f"{base}.replica."
+    for f in glob.glob(glob.escape(prefix) + "*" + glob.escape(ext)):
+        parts = f[len(prefix):len(f) - len(ext)].split(".")
+        if len(parts) > 2 or not all(p.isdigit() for p in parts):
+            continue
+        if len(parts) == 2:
+            pid = int(parts[0])
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+        try:
+            os.remove(f)
+        except OSError:
+            pass  # ainda aberto (Windows): fica para o próximo início
+
+_sweep_orphan_replicas()
+# registrado depois da limpeza para rodar antes dela (atexit é LIFO):
+# o envio final pode criar uma nova geração da réplica
+atexit.register(_flush_upload_at_exit)
+
+def refresh_replica():
+    """Publica uma nova geração da réplica e devolve o caminho da atual."""
+    with _replica_lock:
+        # gerações crescentes também entre reinícios do processo
+        gen = max(_replica["last_gen"] + 1, time.time_ns() // 1000)
+        _replica["last_gen"] = gen
+    path = _replica_path(gen)
+    created = time.time()  # os dados são no mínimo tão novos quanto o início da cópia
+    with _replica_lock:
+        _replica["mine"][path] = gen
+    src = get_conn()
+    dst = sqlite3.connect(path)
+    try:
+        src.backup(dst, pages=1024)
+    finally:
+        dst.close()
+        src.close()
+    with _replica_lock:
+        if gen > _replica["gen"]:
+            _replica.update(prev=_replica["path"], path=path, gen=gen, created=created)
+    _cleanup_replicas()
+    return _replica["path"]
+
+def _primary_mtime():
+    return max(os.path.getmtime(p) for p in (DB_PATH, DB_PATH + "-wal") if os.path.exists(p))
+
+def _current_replica():
+    """Caminho da réplica atual se nada foi gravado no primário depois dela."""
+    path = _replica["path"]
+    if path and os.path.exists(path) and _replica["created"] >= _primary_mtime():
+        return path
+    return None
+
+def _replica_is_fresh():
+    if not _replica["path"]:
+        return False
+    if time.time() - _replica["created"] <= REPLICA_MAX_STALENESS_S:
+        return True
+    # mais velha que o limite, mas nada foi gravado desde a cópia
+    return _replica["created"] >= _primary_mtime()
+
+def _refresh_replica_async():
+    with _replica_lock:
+        if _replica["refreshing"]:
+            return
+        _replica["refreshing"] = True
+
+    def run():
+        try:
+            refresh_replica()
+        except Exception:
+            pass  # as leituras seguem no primário
+        finally:
+            _replica["refreshing"] = False
+
+    threading.Thread(target=run, name="fleet-replica", daemon=True).start()
+
+def get_analytics_conn():
+    """Conexão para leituras analíticas: réplica imutável com mmap quando ela
+    respeita REPLICA_MAX_STALENESS_S; senão o primário em modo somente leitura
+    (e uma nova réplica é preparada em segundo plano)."""
+    if REPLICA_MAX_STALENESS_S <= 0:
+        return get_read_conn()
+    path = _replica["path"]
+    if not path or not _replica_is_fresh():
+        _refresh_replica_async()
+        return get_read_conn()
+    conn = getattr(_read_local, "replica", None)
+    if conn is None or _read_local.replica_path != path:
+        if conn is not None:
+            conn.close()
+            _read_local.replica = None
+        try:
+            uri = Path(path).resolve().as_uri() + "?mode=ro&immutable=1"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={REPLICA_MMAP_BYTES}")
+        except sqlite3.Error:
+            # arquivo da réplica sumiu: lê do primário e prepara outra geração
+            with _replica_lock:
+                if _replica["path"] == path:
+                    _replica.update(path=None, created=0.0)
+            _refresh_replica_async()
+            return get_read_conn()
+        _read_local.replica = conn
+        _read_local.replica_path = path
+    return conn
+
+# ---------- Validação de hodômetro ----------
+# Leituras por tabela: (menor, maior) leitura de cada linha.
+ODOMETER_COLS = {"fuels": ("odometer", "odometer"), "trips": ("km_start", "km_end")}
+# "reject" recusa a gravação; "flag" grava e registra em odometer_flags.
+ODOMETER_MODE = st.secrets["validation"].get("odometer", "reject") if has_secret("validation") else "reject"
+
+class OdometerError(ValueError):
+    """Leitura de hodômetro fora de ordem em relação às vizinhas da placa."""
+
+def init_odometer_checks(conn):
+    """Índices (plate, date, leitura) e tabela de pendências (idempotente)."""
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS odometer_flags (
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        plate TEXT,
+        date TEXT,
+        reading REAL,
+        prev_reading REAL,
+        next_reading REAL,
+        reason TEXT,
+        PRIMARY KEY (tbl, row_id)
+    );
+    """)
+    for t, (lo, hi) in ODOMETER_COLS.items():
+        cols = _table_columns(cur, t)
+        for c in {lo, hi} & cols:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_plate_date_{c} ON {t}(plate, date, {c})")
+    conn.commit()
+
+def _reading(v):
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    return v if v > 0 else None  # 0/vazio = não informado
+
+def odometer_tables(cur):
+    """Entradas de ODOMETER_COLS cujas tabelas existem com as colunas de
+    leitura. Quem valida muitas linhas busca uma vez e repassa (tables=...)."""
+    return {t: (lo, hi) for t, (lo, hi) in ODOMETER_COLS.items()
+            if {"plate", "date", lo, hi} <= _table_columns(cur, t)}
+
+def odometer_neighbors(cur, plate, date_iso, exclude=None, tables=None):
+    """(leitura anterior, leitura seguinte) da placa em volta de date_iso,
+    considerando abastecimentos e viagens. Cada consulta é um seek no índice
+    (plate, date, leitura). exclude=(tabela, id) ignora a própria linha."""
+    prev, nxt = None, None
+    if tables is None:
+        tables = odometer_tables(cur)
+    for t, (lo, hi) in tables.items():
+        skip, args = ("AND id <> ?", (exclude[1],)) if exclude and exclude[0] == t else ("", ())
+        r = cur.execute(
+            f"SELECT {hi} FROM {t} WHERE plate = ? AND date < ? AND {hi} > 0 {skip} "
+            f"ORDER BY date DESC, {hi} DESC LIMIT 1", (plate, date_iso, *args)).fetchone()
+        if r and (prev is None or r[0] > prev):
+            prev = r[0]
+        r = cur.execute(
+            f"SELECT {lo} FROM {t} WHERE plate = ? AND date > ? AND {lo} > 0 {skip} "
+            f"ORDER BY date ASC, {lo} ASC LIMIT 1", (plate, date_iso, *args)).fetchone()
+        if r and (nxt is None or r[0] < nxt):
+            nxt = r[0]
+    return prev, nxt
+
+def check_odometer(cur, table, row, row_id=None, tables=None):
+    """Confere as leituras de `row` (dict com plate, date e colunas de
+    ODOMETER_COLS) contra as vizinhas. Devolve (problemas, anterior, seguinte);
+    no modo "reject" levanta OdometerError se houver problemas."""
+    if table not in ODOMETER_COLS or not row.get("plate") or not row.get("date"):
+        return [], None, None
+    lo_col, hi_col = ODOMETER_COLS[table]
+    lo, hi = _reading(row.get(lo_col)), _reading(row.get(hi_col))
+    lo, hi = lo or hi, hi or lo
+    if lo is None:
+        return [], None, None
+    exclude = (table, row_id) if row_id else None
+    prev, nxt = odometer_neighbors(cur, row["plate"], str(row["date"]), exclude, tables)
+    issues = []
+    if hi < lo:
+        issues.append(f"{hi_col} ({hi:.0f}) menor que {lo_col} ({lo:.0f})")
+    if prev is not None and lo < prev:
+        issues.append(f"leitura {lo:.0f} menor que a anterior ({prev:.0f})")
+    if nxt is not None and hi > nxt:
+        issues.append(f"leitura {hi:.0f} maior que a seguinte ({nxt:.0f})")
+    if issues and ODOMETER_MODE == "reject":
+        raise OdometerError(f"Hodômetro inconsistente para {row['plate']} em {row['date']}: " + "; ".join(issues))
+    return issues, prev, nxt
+
+def _flag_odometer(cur, table, row_id, row, result):
+    issues, prev, nxt = result
+    cur.execute("DELETE FROM odometer_flags WHERE tbl = ? AND row_id = ?", (table, row_id))
+    if issues:
+        lo_col, hi_col = ODOMETER_COLS[table]
+        cur.execute(
+            "INSERT INTO odometer_flags VALUES (?,?,?,?,?,?,?,?)",
+            (table, row_id, row.get("plate"), row.get("date"),
+             _reading(row.get(hi_col)) or _reading(row.get(lo_col)), prev, nxt, "; ".join(issues)),
+        )
+
+def revalidate_odometers():
+    """Revalida todo o histórico numa única passada com funções de janela
+    (maior leitura dos dias anteriores / menor dos dias seguintes, por placa)
+    e substitui o conteúdo de odometer_flags. Devolve as pendências."""
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(query, params)
+    parts = []
+    for t, (lo, hi) in ODOMETER_COLS.items():
+        if {"plate", "day_key", lo, hi} <= _table_columns(cur, t):
+            parts.append(f"""
+                SELECT '{t}' AS tbl, id, plate, date, day_key,
+                       COALESCE(NULLIF({lo}, 0), NULLIF({hi}, 0)) AS lo,
+                       COALESCE(NULLIF({hi}, 0), NULLIF({lo}, 0)) AS hi
+                FROM {t} WHERE day_key IS NOT NULL AND ({lo} > 0 OR {hi} > 0)""")
+    cur.execute("DELETE FROM odometer_flags")
+    if parts:
+        cur.execute(f"""
+            INSERT INTO odometer_flags
+            SELECT tbl, id, plate, date, hi, prev, nxt,
+                   CASE WHEN hi < lo THEN 'leitura final menor que a inicial'
+                        WHEN lo < prev THEN 'leitura menor que a anterior'
+                        ELSE 'leitura maior que a seguinte' END
+            FROM (
+                SELECT *,
+                       MAX(hi) OVER (PARTITION BY plate ORDER BY day_key
+                                     RANGE BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS prev,
+                       MIN(lo) OVER (PARTITION BY plate ORDER BY day_key
+                                     RANGE BETWEEN 1 FOLLOWING AND UNBOUNDED FOLLOWING) AS nxt
+                FROM ({" UNION ALL ".join(parts)})
+            )
+            WHERE hi < lo OR lo < prev OR hi > nxt
+        """)
     conn.commit()
     conn.close()
+    return fetch_df("SELECT * FROM odometer_flags ORDER BY plate, date")
+
+def execute(query, params=()):
+    """INSERT/UPDATE/DELETE unitários; agenda o envio ao Dropbox após o commit."""
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        conn.commit()
+    finally:
+        conn.close()  # ex.: data recusada por _date_checks => nada gravado
     if DROPBOX_ENABLED:
-        _upload_to_dropbox()
+        _request_upload()
 
 def insert_many(table, rows):
-    """Inserção em lote; sincroniza ao final."""
+    """Inserção em lote com validação de hodômetro; agenda o envio ao final.
+    No modo "reject" nada é gravado se alguma linha for recusada."""
     if not rows:
         return
+    rows = [_normalize_date(table, r) for r in rows]
     conn = get_conn()
     cur = conn.cursor()
     cols = list(rows[0].keys())
     placeholders = ",".join(["?"] * len(cols))
     sql = f"INSERT INTO {table} ({','.join(cols)}) VALUES ({placeholders})"
-    cur.executemany(sql, [tuple(r[c] for c in cols) for r in rows])
-    conn.commit()
-    conn.close()
+    try:
+        if table in ODOMETER_COLS:
+            # linha a linha: cada leitura é conferida contra as anteriores do lote
+            tables = odometer_tables(cur)
+            for r in rows:
+                result = check_odometer(cur, table, r, tables=tables)
+                cur.execute(sql, tuple(r[c] for c in cols))
+                if ODOMETER_MODE == "flag":
+                    _flag_odometer(cur, table, cur.lastrowid, r, result)
+        else:
+            cur.executemany(sql, [tuple(r[c] for c in cols) for r in rows])
+        conn.commit()
+    finally:
+        conn.close()  # sem commit => nada gravado
+    if DROPBOX_ENABLED:
+        _request_upload()
+
+def insert_row(table, row):
+    """INSERT de uma linha (dict) com validação de hodômetro."""
+    insert_many(table, [row])
+
+def update_row(table, keycol, keyval, changes):
+    """UPDATE de uma linha com validação de hodômetro sobre os valores finais
+    (só quando a edição mexe em placa, data ou leitura: linhas antigas já
+    fora de ordem continuam editáveis nos demais campos)."""
+    # valores vindos do data_editor podem ser escalares numpy (float32, int8...)
+    changes = {c: (v.item() if isinstance(v, np.generic) else v) for c, v in changes.items()}
+    changes = _normalize_date(table, changes)
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        if table in ODOMETER_COLS and {"plate", "date", *ODOMETER_COLS[table]} & changes.keys():
+            cur.execute(f"SELECT * FROM {table} WHERE {keycol} = ?", (keyval,))
+            names = [d[0] for d in cur.description]
+            current = cur.fetchone()
+            if current is not None:
+                row = dict(zip(names, current), **changes)
+                result = check_odometer(cur, table, row, row["id"])
+                if ODOMETER_MODE == "flag":
+                    _flag_odometer(cur, table, row["id"], row, result)
+        set_clause = ", ".join(f"{c}=?" for c in changes)
+        cur.execute(f"UPDATE {table} SET {set_clause} WHERE {keycol}=?", (*changes.values(), keyval))
+        conn.commit()
+    finally:
+        conn.close()  # sem commit => nada gravado
     if DROPBOX_ENABLED:
-        _upload_to_dropbox()
+        _request_upload()
 
 def get_params(category):
     df = fetch_df("SELECT value FROM parameters WHERE category=? ORDER BY value ASC", (category,))
     return df["value"].tolist()
 
 def month_yyyymm(date_str):
+    # datas já normalizadas (AAAA-MM-DD) dispensam o parse
+    if len(date_str) >= 7 and date_str[4] == "-" and date_str[:4].isdigit():
+        return date_str[:7]
     try:
         dt = datetime.fromisoformat(date_str)
     except ValueError:
@@ -0,0 +1,405 @@
+# ingest.py
+"""Serviço de ingestão sem UI para rastreadores e cartões combustível.
+
+Roda fora do processo do Streamlit, sobre o mesmo fleet.db (db.py):
+- recebe eventos em lote por HTTP (POST /events, corpo JSON-lines ou lista
+  JSON) ou por JSON-lines na entrada padrão;
+- enfileira numa fila limitada (fila cheia => HTTP 503 + Retry-After, ou
+  bloqueio na leitura do stdin; lote maior que a fila inteira => HTTP 413);
+- uma thread gravadora agrupa os eventos em transações; cada evento roda num
+  SAVEPOINT (um evento inválido é recusado sozinho) e, se o banco estiver
+  travado ou falhar o disco, o lote inteiro é refeito;
+- eventos repetidos são descartados pelo id do provedor (EVENT_ID_FIELDS)
+  ou, sem ele, pela chave natural (NATURAL_KEYS);
+- leituras de hodômetro passam pela mesma validação de db.py;
+- o envio ao Dropbox é feito uma vez por SYNC_INTERVAL, e não por evento.
+
+Eventos: {"kind": "fuel" | "trip" | "cost", "plate": ..., "date": ..., "event_id": ..., ...}
+
+Uso:
+    python ingest.py --port 8765
+    python scripts/gen_events.py 50000 | python ingest.py --stdin
+"""
+import argparse
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import db
+
+# kind -> (tabela, campos aceitos, chave natural usada quando o evento não traz id)
+KINDS = {
+    "fuel": (
+        "fuels",
+        ("date", "plate", "driver_id", "station", "liters", "unit_price", "total", "odometer", "payment", "notes"),
+        ("plate", "date", "odometer", "liters"),
+    ),
+    "trip": (
+        "trips",
+        ("date", "plate", "driver_id", "client", "revenue", "nfe", "origin", "destination",
+         "km_start", "km_end", "km_driven", "notes"),
+        ("plate", "date", "km_start", "km_end"),
+    ),
+    "cost": (
+        "costs",
+        ("date", "plate", "driver_id", "ctype", "description", "amount", "notes"),
+        ("plate", "date", "ctype", "amount"),
+    ),
+}
+NATURAL_KEYS = {k: v[2] for k, v in KINDS.items()}
+# id do evento/transação no provedor (rastreador, cartão combustível)
+EVENT_ID_FIELDS = ("event_id", "transaction_id")
+NUMERIC_FIELDS = {"liters", "unit_price", "total", "odometer", "revenue", "km_start", "km_end", "km_driven", "amount"}
+
+QUEUE_MAX = 50_000
+BATCH_MAX = 5_000
+BATCH_WAIT_S = 0.2
+SYNC_INTERVAL_S = 30
+RETRY_WAIT_S = 1.0
+# falhas do banco (trava, disco), não do evento: o lote inteiro é refeito
+RETRY_ERRORS = ("SQLITE_BUSY", "SQLITE_LOCKED", "SQLITE_IOERR", "SQLITE_FULL", "SQLITE_CANTOPEN")
+
+
+class IngestError(ValueError):
+    pass
+
+
+def _is_transient(e):
+    name = getattr(e, "sqlite_errorname", "")
+    if name:
+        return name.startswith(RETRY_ERRORS)
+    msg = str(e).lower()
+    return "locked" in msg or "disk" in msg or "unable to open" in msg
+
+
+def _iso_date(v):
+    try:
+        return db.iso_date(v)
+    except ValueError as e:
+        raise IngestError(str(e))
+
+
+def normalize(ev):
+    """Valida e normaliza um evento; devolve (kind, dict de colunas)."""
+    if not isinstance(ev, dict):
+        raise IngestError("evento deve ser um objeto JSON")
+    kind = ev.get("kind")
+    if not isinstance(kind, str) or kind not in KINDS:
+        raise IngestError(f"kind desconhecido: {kind!r}")
+    _, fields, _ = KINDS[kind]
+    if not ev.get("plate") or not ev.get("date"):
+        raise IngestError("plate e date são obrigatórios")
+    row = {}
+    for f in fields:
+        v = ev.get(f)
+        if v is None:
+            continue
+        if f in NUMERIC_FIELDS:
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                raise IngestError(f"{f} deve ser numérico")
+        elif not isinstance(v, (str, int, float)):
+            # listas/objetos não viram parâmetro do SQLite
+            raise IngestError(f"{f} deve ser texto ou número")
+        row[f] = v
+    row["plate"] = str(row["plate"]).upper().strip()
+    row["date"] = _iso_date(row["date"])
+    if kind == "fuel" and "total" not in row and "liters" in row and "unit_price" in row:
+        row["total"] = round(row["liters"] * row["unit_price"], 2)
+    return kind, row
+
+
+def natural_key(kind, row):
+    return "|".join("" if row.get(f) is None else str(row[f]) for f in NATURAL_KEYS[kind])
+
+
+def event_key(kind, ev, row):
+    """Chave de deduplicação: o id do provedor, se o evento tiver um;
+    senão a chave natural (que junta, p.ex., dois pedágios de mesmo valor
+    no mesmo dia)."""
+    for f in EVENT_ID_FIELDS:
+        v = ev.get(f)
+        if v is None or v == "":
+            continue
+        if not isinstance(v, (str, int)) or isinstance(v, bool):
+            raise IngestError(f"{f} deve ser texto ou inteiro")
+        return f"#{f}:{v}"
+    return natural_key(kind, row)
+
+
+def parse_body(body):
+    """Aceita lista JSON, objeto JSON único ou JSON-lines."""
+    text = body.decode("utf-8").strip()
+    if not text:
+        return []
+    if text[0] == "[":
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class Ingestor:
+    """Fila limitada + thread gravadora que aplica lotes em transações."""
+
+    def __init__(self, queue_max=QUEUE_MAX, batch_max=BATCH_MAX, batch_wait=BATCH_WAIT_S, sync_interval=SYNC_INTERVAL_S):
+        self.queue = queue.Queue(maxsize=queue_max)
+        self.batch_max = batch_max
+        self.batch_wait = batch_wait
+        self.sync_interval = sync_interval
+        self.stats = {"received": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "batches": 0, "retries": 0, "syncs": 0, "sync_errors": 0}
+        self._put_lock = threading.Lock()
+        self._dirty = False
+        self._retry = None  # lote que falhou por trava/disco, refeito antes dos próximos
+        self._last_sync = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="fleet-ingest", daemon=True)
+
+    # ----- entrada -----
+    def offer(self, events):
+        """Enfileira o lote inteiro ou nada (False => fila cheia, tente depois)."""
+        with self._put_lock:
+            if self.queue.qsize() + len(events) > self.queue.maxsize:
+                return False
+            for ev in events:
+                self.queue.put_nowait(ev)
+            self.stats["received"] += len(events)
+        return True
+
+    def put(self, ev):
+        """Enfileira bloqueando enquanto a fila estiver cheia."""
+        self.queue.put(ev)
+        self.stats["received"] += 1
+
+    # ----- gravação -----
+    def start(self):
+        conn = db.get_conn()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_keys (
+            kind TEXT NOT NULL,
+            nkey TEXT NOT NULL,
+            row_id INTEGER,
+            PRIMARY KEY (kind, nkey)
+        ) WITHOUT ROWID;
+        """)
+        conn.commit()
+        self._columns = {kind: db._table_columns(conn.cursor(), t) for kind, (t, _, _) in KINDS.items()}
+        self._odometer_tables = db.odometer_tables(conn.cursor())
+        conn.close()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Grava o que estiver na fila, faz o sync final e encerra."""
+        self._stop.set()
+        self._thread.join()
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_max:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, cur, kind, row, nkey):
+        """Grava um evento normalizado; devolve "inserted" ou "duplicates"."""
+        cur.execute("INSERT OR IGNORE INTO ingest_keys (kind, nkey) VALUES (?,?)", (kind, nkey))
+        if cur.rowcount == 0:
+            return "duplicates"
+        table = KINDS[kind][0]
+        result = db.check_odometer(cur, table, row, tables=self._odometer_tables)
+        cols = [c for c in row if c in self._columns[kind]]
+        cur.execute(
+            f"INSERT INTO {table} ({','.join(cols)}) VALUES ({','.join(['?'] * len(cols))})",
+            tuple(row[c] for c in cols),
+        )
+        row_id = cur.lastrowid
+        cur.execute("UPDATE ingest_keys SET row_id=? WHERE kind=? AND nkey=?", (row_id, kind, nkey))
+        if db.ODOMETER_MODE == "flag":
+            db._flag_odometer(cur, table, row_id, row, result)
+        return "inserted"
+
+    def _apply(self, conn, batch):
+        """Aplica o lote numa transação. Cada evento roda num SAVEPOINT: erro
+        do evento (hodômetro, valor que o SQLite recusa) desfaz só ele. Trava
+        ou falha de disco desfaz o lote, que é refeito (devolve False)."""
+        counts = {"inserted": 0, "duplicates": 0, "rejected": 0}
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN")
+            for ev in batch:
+                try:
+                    kind, row = normalize(ev)
+                    nkey = event_key(kind, ev, row)
+                except Exception as e:
+                    # IngestError ou qualquer surpresa num evento: recusa só ele
+                    if not isinstance(e, IngestError):
+                        self._log_error(ev, e)
+                    counts["rejected"] += 1
+                    continue
+                if not self._columns[kind]:
+                    # tabela inexistente neste banco
+                    counts["rejected"] += 1
+                    continue
+                cur.execute("SAVEPOINT ev")
+                try:
+                    status = self._insert(cur, kind, row, nkey)
+                except Exception as e:
+                    if isinstance(e, sqlite3.Error) and _is_transient(e):
+                        raise
+                    if not isinstance(e, (db.OdometerError, sqlite3.Error)):
+                        self._log_error(ev, e)
+                    cur.execute("ROLLBACK TO ev")
+                    status = "rejected"
+                cur.execute("RELEASE ev")
+                counts[status] += 1
+            conn.commit()
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            self.stats["retries"] += 1
+            return False
+        for k, v in counts.items():
+            self.stats[k] += v
+        self.stats["batches"] += 1
+        self._dirty = self._dirty or counts["inserted"] > 0
+        return True
+
+    def _log_error(self, ev, e):
+        print(f"ingest: evento recusado por erro inesperado ({type(e).__name__}: {e}): {ev!r:.200}", file=sys.stderr)
+
+    def _sync(self, force=False):
+        if not self._dirty:
+            return
+        if not force and time.monotonic() - self._last_sync < self.sync_interval:
+            return
+        if db.DROPBOX_ENABLED:
+            db._upload_to_dropbox()
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self.stats["syncs"] += 1
+
+    def _run(self):
+        conn = sqlite3.connect(db.DB_PATH, timeout=30, isolation_level=None)
+        try:
+            while not (self._stop.is_set() and self.queue.empty() and self._retry is None):
+                batch = self._retry or self._next_batch()
+                self._retry = None
+                # a thread gravadora nunca morre: lote com erro é refeito, sync com erro é reagendado
+                try:
+                    if batch and not self._apply(conn, batch):
+                        self._retry = batch
+                        time.sleep(RETRY_WAIT_S)
+                except Exception as e:
+                    print(f"ingest: erro ao gravar lote ({type(e).__name__}: {e}); tentando de novo", file=sys.stderr)
+                    if conn.in_transaction:
+                        conn.rollback()
+                    self._retry = batch
+                    self.stats["retries"] += 1
+                    time.sleep(RETRY_WAIT_S)
+                self._safe_sync()
+            self._safe_sync(force=True)
+        finally:
+            conn.close()
+
+    def _safe_sync(self, force=False):
+        try:
+            self._sync(force)
+        except Exception as e:
+            # continua sujo; nova tentativa no próximo intervalo
+            print(f"ingest: falha no envio ao Dropbox ({type(e).__name__}: {e})", file=sys.stderr)
+            self.stats["sync_errors"] += 1
+            self._last_sync = time.monotonic()
+
+
+def make_handler(ingestor):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._reply(404, {"error": "not found"})
+            self._reply(200, dict(ingestor.stats, queued=ingestor.queue.qsize()))
+
+        def do_POST(self):
+            if self.path != "/events":
+                return self._reply(404, {"error": "not found"})
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                events = parse_body(self.rfile.read(length))
+            except (ValueError, UnicodeDecodeError) as e:
+                return self._reply(400, {"error": f"JSON inválido: {e}"})
+            if isinstance(events, dict):
+                events = [events]
+            if len(events) > ingestor.queue.maxsize:
+                # nunca caberia na fila: 503 faria o cliente repetir para sempre
+                return self._reply(413, {"error": f"lote maior que a fila ({ingestor.queue.maxsize} eventos); divida o envio"})
+            if not ingestor.offer(events):
+                return self._reply(503, {"error": "fila cheia"}, {"Retry-After": "1"})
+            self._reply(202, {"accepted": len(events)})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Ingestão de eventos de frota no fleet.db")
+    ap.add_argument("--stdin", action="store_true", help="lê JSON-lines da entrada padrão e encerra no fim")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--batch", type=int, default=BATCH_MAX, help="máximo de eventos por transação")
+    ap.add_argument("--sync-interval", type=float, default=SYNC_INTERVAL_S, help="segundos entre envios ao Dropbox")
+    args = ap.parse_args(argv)
+
+    db.init_db()
+    ingestor = Ingestor(batch_max=args.batch, sync_interval=args.sync_interval).start()
+
+    if args.stdin:
+        t0 = time.monotonic()
+        for line in sys.stdin:
+            if line.strip():
+                try:
+                    ingestor.put(json.loads(line))
+                except ValueError:
+                    ingestor.stats["rejected"] += 1
+        ingestor.stop()
+        elapsed = time.monotonic() - t0
+        rate = ingestor.stats["received"] / elapsed if elapsed else 0
+        print(json.dumps(dict(ingestor.stats, seconds=round(elapsed, 2), events_per_s=round(rate))))
+        return
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(ingestor))
+    print(f"Ingestão em http://{args.host}:{args.port}/events (Ctrl+C para sair)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ingestor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# ledger.py
+"""Razão (ledger) materializado por veículo e custo/receita por km.
+
+`vehicle_ledger` tem uma linha por movimento financeiro (abastecimentos,
+manutenções e custos negativos; fretes positivos) com saldo acumulado por
+placa. `vehicle_cost_summary` guarda, por placa, custo/receita e km da vida
+toda e dos últimos 12 meses.
+
+A atualização é incremental:
+- linhas novas são lidas a partir do maior id já processado (`ledger_state`);
+- edições e exclusões chegam pelo `change_log`, alimentado por triggers;
+- só o saldo das placas afetadas, a partir do dia mais antigo alterado, é
+  recalculado.
+"""
+from datetime import date, timedelta
+
+import db
+
+# tabela -> (colunas de valor candidatas, sinal, colunas de hodômetro, colunas de descrição)
+SOURCES = {
+    "fuels": (("total",), -1, ("odometer",), ("station",)),
+    "maints": (("cost",), -1, (), ("type",)),
+    "costs": (("amount",), -1, (), ("ctype", "category")),
+    "trips": (("revenue", "freight_value"), 1, ("km_end",), ("client",)),
+}
+
+
+def _first(cols, candidates):
+    return next((c for c in candidates if c in cols), None)
+
+
+def _source_select(cur, t):
+    """SELECT que converte linhas de `t` em linhas do ledger (None se a
+    tabela não existir ou ainda não tiver day_key)."""
+    cols = db._table_columns(cur, t)
+    if not {"id", "plate", "day_key"} <= cols:
+        return None, ()
+    amount_cols, sign, odo_cols, desc_cols = SOURCES[t]
+    amount = _first(cols, amount_cols)
+    if amount is None:
+        return None, ()
+    odo = _first(cols, odo_cols)
+    desc = _first(cols, desc_cols)
+    sql = f"""
+        SELECT '{t}', id, plate, date, IFNULL(day_key, 0), {sign} * IFNULL({amount}, 0),
+               {f"NULLIF({odo}, 0)" if odo else "NULL"}, {desc or "NULL"}
+        FROM {t}"""
+    tracked = [c for c in ("plate", "date", amount, odo, desc) if c]
+    return sql, tracked
+
+
+def init_ledger():
+    """Cria tabelas e triggers do ledger (idempotente)."""
+    conn = db.get_conn()
+    cur = conn.cursor()
+    cur.executescript("""
+    CREATE TABLE IF NOT EXISTS vehicle_ledger (
+        source TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        plate TEXT,
+        date TEXT,
+        day_key INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        odometer REAL,
+        description TEXT,
+        balance REAL,
+        PRIMARY KEY (source, source_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_ledger_plate_day ON vehicle_ledger(plate, day_key, source, source_id);
+
+    CREATE TABLE IF NOT EXISTS ledger_state (
+        source TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS vehicle_cost_summary (
+        plate TEXT PRIMARY KEY,
+        lifetime_cost REAL,
+        lifetime_revenue REAL,
+        lifetime_km REAL,
+        cost_per_km REAL,
+        revenue_per_km REAL,
+        ttm_cost REAL,
+        ttm_revenue REAL,
+        ttm_km REAL,
+        ttm_cost_per_km REAL,
+        ttm_revenue_per_km REAL,
+        as_of INTEGER
+    );
+    """)
+    for t in SOURCES:
+        sql, tracked = _source_select(cur, t)
+        if sql is None:
+            continue
+        log = f"INSERT INTO change_log (tbl, row_id) VALUES ('{t}', OLD.id);"
+        cur.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_ledger_upd AFTER UPDATE OF {", ".join(tracked)} ON {t}
+        BEGIN {log} END;
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_ledger_del AFTER DELETE ON {t}
+        BEGIN {log} END;
+        CREATE TRIGGER IF NOT EXISTS trg_{t}_ledger_ins AFTER INSERT ON {t}
+        WHEN NEW.id <= IFNULL((SELECT last_id FROM ledger_state WHERE source = '{t}'), 0)
+        BEGIN INSERT INTO change_log (tbl, row_id) VALUES ('{t}', NEW.id); END;
+        """)
+    conn.commit()
+    conn.close()
+
+
+def _mark(affected, rows):
+    for plate, day in rows:
+        if plate is not None:
+            affected[plate] = min(day, affected.get(plate, day))
+
+
+def _rebalance(cur, plate, since):
+    base = cur.execute(
+        "SELECT IFNULL(SUM(amount), 0) FROM vehicle_ledger WHERE plate = ? AND day_key < ?", (plate, since)
+    ).fetchone()[0]
+    cur.execute("""
+        WITH w AS (
+            SELECT source, source_id,
+                   ? + SUM(amount) OVER (ORDER BY day_key, source, source_id) AS b
+            FROM vehicle_ledger WHERE plate = ? AND day_key >= ?
+        )
+        UPDATE vehicle_ledger SET balance = w.b
+        FROM w WHERE vehicle_ledger.source = w.source AND vehicle_ledger.source_id = w.source_id
+    """, (base, plate, since))
+
+
+def _summarize(cur, plates, today_key):
+    ttm = int((date.today() - timedelta(days=365)).strftime("%Y%m%d"))
+    marks = ",".join("?" * len(plates))
+    cur.execute(f"DELETE FROM vehicle_cost_summary WHERE plate IN ({marks})", plates)
+    cur.execute(f"""
+        INSERT INTO vehicle_cost_summary
+        SELECT plate, cost, revenue, km,
+               cost / NULLIF(km, 0), revenue / NULLIF(km, 0),
+               ttm_cost, ttm_revenue, ttm_km,
+               ttm_cost / NULLIF(ttm_km, 0), ttm_revenue / NULLIF(ttm_km, 0),
+               ?
+        FROM (
+            SELECT plate,
+                   SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END) AS cost,
+                   SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) AS revenue,
+                   MAX(odometer) - MIN(odometer) AS km,
+                   SUM(CASE WHEN amount < 0 AND day_key >= ? THEN -amount ELSE 0 END) AS ttm_cost,
+                   SUM(CASE WHEN amount > 0 AND day_key >= ? THEN amount ELSE 0 END) AS ttm_revenue,
+                   MAX(CASE WHEN day_key >= ? THEN odometer END)
+                     - MIN(CASE WHEN day_key >= ? THEN odometer END) AS ttm_km
+            FROM vehicle_ledger WHERE plate IN ({marks}) GROUP BY plate
+        )
+    """, (today_key, ttm, ttm, ttm, ttm, *plates))
+
+
+def refresh_ledger():
+    """Aplica ao ledger só o que mudou desde a última atualização.
+    Devolve o número de placas recalculadas."""
+    conn = db.get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        affected = {}
+        seq = cur.execute("SELECT IFNULL(MAX(seq), 0) FROM change_log").fetchone()[0]
+        for t in SOURCES:
+            sql, _ = _source_select(cur, t)
+            if sql is None:
+                continue
+            # 1) edições/exclusões registradas no change_log
+            changed = "SELECT row_id FROM change_log WHERE tbl = ? AND seq <= ?"
+            _mark(affected, cur.execute(
+                f"SELECT plate, MIN(day_key) FROM vehicle_ledger WHERE source = ? AND source_id IN ({changed}) GROUP BY plate",
+                (t, t, seq)).fetchall())
+            cur.execute(f"DELETE FROM vehicle_ledger WHERE source = ? AND source_id IN ({changed})", (t, t, seq))
+            cur.execute(f"INSERT OR REPLACE INTO vehicle_ledger (source, source_id, plate, date, day_key, amount, odometer, description) "
+                        f"{sql} WHERE id IN ({changed})", (t, seq))
+            _mark(affected, cur.execute(
+                f"SELECT plate, MIN(IFNULL(day_key, 0)) FROM {t} WHERE id IN ({changed}) GROUP BY plate", (t, seq)).fetchall())
+
+            # 2) linhas novas acima da marca d'água
+            last_id = cur.execute("SELECT IFNULL((SELECT last_id FROM ledger_state WHERE source = ?), 0)", (t,)).fetchone()[0]
+            max_id = cur.execute(f"SELECT IFNULL(MAX(id), 0) FROM {t}").fetchone()[0]
+            if max_id > last_id:
+                cur.execute(f"INSERT OR REPLACE INTO vehicle_ledger (source, source_id, plate, date, day_key, amount, odometer, description) "
+                            f"{sql} WHERE id > ? AND id <= ?", (last_id, max_id))
+                _mark(affected, cur.execute(
+                    f"SELECT plate, MIN(IFNULL(day_key, 0)) FROM {t} WHERE id > ? AND id <= ? GROUP BY plate",
+                    (last_id, max_id)).fetchall())
+                cur.execute("INSERT OR REPLACE INTO ledger_state (source, last_id) VALUES (?, ?)", (t, max_id))
+        cur.execute("DELETE FROM change_log WHERE seq <= ?", (seq,))
+
+        for plate, since in affected.items():
+            _rebalance(cur, plate, since)
+
+        # O resumo dos últimos 12 meses depende do dia: ao virar o dia, recalcula todas as placas.
+        today_key = int(date.today().strftime("%Y%m%d"))
+        stale = [r[0] for r in cur.execute(
+            "SELECT DISTINCT plate FROM vehicle_ledger WHERE plate NOT IN "
+            "(SELECT plate FROM vehicle_cost_summary WHERE as_of = ?)", (today_key,)).fetchall()]
+        plates = sorted(set(affected) | set(stale))
+        for i in range(0, len(plates), 500):
+            _summarize(cur, plates[i:i + 500], today_key)
+        conn.commit()
+        return len(plates)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# Lidos do primário (e não da réplica): a página chama refresh_ledger logo
+# antes e precisa ver o resultado.
+def vehicle_summary(plate):
+    return db.fetch_df("SELECT * FROM vehicle_cost_summary WHERE plate = ?", (plate,))
+
+
+def vehicle_ledger(plate):
+    return db.fetch_typed_df(
+        "SELECT day_key AS date, source, description, amount, odometer, balance FROM vehicle_ledger "
+        "WHERE plate = ? ORDER BY day_key DESC, source DESC, source_id DESC",
+        (plate,),
+        date_cols=("date",),
+    )
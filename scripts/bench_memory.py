@@ -0,0 +1,107 @@
+# scripts/bench_memory.py
+"""Benchmark de memória das listagens (uma sessão, página Abastecimentos).
+
+Compara o caminho antigo (fetch_df + pd.to_datetime(...).dt.date + df.copy()
+no editor + astype(str) por coluna no filtro) com o caminho compacto, com a
+mesma consulta da página (fetch_typed_df sobre day_key AS data + editor/filtro
+sem cópias).
+
+Uso (na raiz do projeto):
+    python scripts/bench_memory.py [linhas]
+"""
+import os
+import sqlite3
+import sys
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import compact_df  # noqa: E402
+
+QUERY = """
+SELECT id, {date} AS data, plate AS placa, driver AS motorista, station AS posto,
+       liters AS litros, unit_price AS preco, total, odometer AS hodometro,
+       payment AS pagamento, notes AS obs
+FROM fuels ORDER BY date DESC, id DESC
+"""
+OLD_QUERY = QUERY.format(date="date")
+NEW_QUERY = QUERY.format(date="day_key")
+
+
+def make_conn(n):
+    rng = np.random.default_rng(42)
+    plates = [f"ABC{i:04d}" for i in range(40)]
+    stations = [f"Posto {i}" for i in range(15)]
+    payments = ["Dinheiro", "Pix", "Cartão", "Boleto"]
+    drivers = [f"Motorista {i}" for i in range(30)]
+    days = pd.date_range("2022-01-01", periods=1000).strftime("%Y-%m-%d")
+    date = rng.choice(days, n)
+    liters = rng.uniform(20, 300, n).round(2)
+    price = rng.uniform(5, 7, n).round(2)
+    rows = zip(
+        range(1, n + 1),
+        date.tolist(),
+        np.char.replace(date.astype(str), "-", "").astype(int).tolist(),
+        rng.choice(plates, n).tolist(),
+        rng.choice(drivers, n).tolist(),
+        rng.choice(stations, n).tolist(),
+        liters.tolist(),
+        price.tolist(),
+        (liters * price).round(2).tolist(),
+        rng.integers(10_000, 900_000, n).astype(float).tolist(),
+        rng.choice(payments, n).tolist(),
+        [""] * n,
+    )
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""CREATE TABLE fuels (id INTEGER PRIMARY KEY, date TEXT, day_key INTEGER, plate TEXT, driver TEXT,
+        station TEXT, liters REAL, unit_price REAL, total REAL, odometer REAL, payment TEXT, notes TEXT)""")
+    conn.executemany("INSERT INTO fuels VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+    return conn
+
+
+def old_path(conn):
+    df = pd.read_sql_query(OLD_QUERY, conn)
+    df["data"] = pd.to_datetime(df["data"], errors="coerce").dt.date
+    # filter_table: astype(str) para montar opções de cada coluna
+    for c in df.columns:
+        df[c].astype(str).replace({"nan": ""}).dropna().unique().tolist()
+    # editor_delete_update: cópia + coluna Excluir
+    view = df.copy()
+    view.insert(0, "Excluir", False)
+    return df, view
+
+
+def new_path(conn):
+    df = compact_df(pd.read_sql_query(NEW_QUERY, conn), date_cols=("data",))
+    for c in df.columns:
+        sorted(str(v) for v in df[c].dropna().unique())
+    view = pd.concat([pd.DataFrame({"Excluir": False}, index=df.index), df], axis=1, copy=False)
+    return df, view
+
+
+def measure(fn, conn):
+    """Memória retida pelos DataFrames que a página mantém (df + view do
+    editor) e pico durante a montagem (inclui as opções dos filtros)."""
+    tracemalloc.start()
+    df, view = fn(conn)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df.memory_usage(deep=True).sum(), current, peak
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    conn = make_conn(n)
+    print(f"linhas: {n}")
+    res = {}
+    for name, fn in (("antigo", old_path), ("compacto", new_path)):
+        frame, current, peak = measure(fn, conn)
+        res[name] = current
+        print(f"{name:9s} df={frame / 2**20:8.2f} MiB  retido={current / 2**20:8.2f} MiB  pico={peak / 2**20:8.2f} MiB")
+    print(f"redução da memória retida por sessão: {res['antigo'] / res['compacto']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# scripts/gen_events.py
+"""Gera eventos sintéticos (abastecimentos, viagens, custos) para testar o ingest.py.
+
+Uso (na raiz do projeto):
+    python scripts/gen_events.py 50000 | python ingest.py --stdin
+    python scripts/gen_events.py 50000 --url http://127.0.0.1:8765/events --batch 1000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import date, timedelta
+
+
+def events(n, plates, dup_ratio, seed, id_ratio=0.5):
+    rnd = random.Random(seed)
+    odo = {p: rnd.randint(10_000, 200_000) for p in plates}
+    start = date.today() - timedelta(days=365)
+    sent = []
+    for i in range(n):
+        if sent and rnd.random() < dup_ratio:
+            yield rnd.choice(sent)  # reenvio (deve ser descartado pela chave natural)
+            continue
+        plate = rnd.choice(plates)
+        d = (start + timedelta(days=i * 365 // max(n, 1))).isoformat()
+        kind = rnd.choices(("fuel", "trip", "cost"), weights=(5, 4, 1))[0]
+        if kind == "fuel":
+            odo[plate] += rnd.randint(50, 600)
+            liters = round(rnd.uniform(30, 300), 2)
+            ev = {"kind": "fuel", "date": d, "plate": plate, "liters": liters,
+                  "unit_price": round(rnd.uniform(5, 7), 2), "odometer": odo[plate],
+                  "station": f"Posto {rnd.randint(1, 10)}", "payment": "Cartão"}
+        elif kind == "trip":
+            km = rnd.randint(20, 800)
+            ev = {"kind": "trip", "date": d, "plate": plate, "km_start": odo[plate],
+                  "km_end": odo[plate] + km, "km_driven": km,
+                  "revenue": round(km * rnd.uniform(3, 6), 2)}
+            odo[plate] += km
+        else:
+            ev = {"kind": "cost", "date": d, "plate": plate, "ctype": "Pedágio",
+                  "amount": round(rnd.uniform(10, 200), 2), "description": f"evento {i}"}
+        if rnd.random() < id_ratio:
+            ev["event_id"] = f"{seed}-{i}"
+        sent.append(ev)
+        yield ev
+
+
+def post(url, batch):
+    body = "\n".join(json.dumps(e) for e in batch).encode("utf-8")
+    while True:
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/x-ndjson"})
+        try:
+            urllib.request.urlopen(req).read()
+            return
+        except urllib.error.HTTPError as e:
+            if e.code == 413 and len(batch) > 1:
+                # lote maior que a fila do servidor: envia em duas metades
+                half = len(batch) // 2
+                post(url, batch[:half])
+                post(url, batch[half:])
+                return
+            if e.code != 503:
+                raise
+            time.sleep(float(e.headers.get("Retry-After", 1)))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("n", type=int, nargs="?", default=10_000)
+    ap.add_argument("--plates", type=int, default=20)
+    ap.add_argument("--dup", type=float, default=0.05, help="fração de eventos reenviados")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--ids", type=float, default=0.5, help="fração de eventos com event_id do provedor")
+    ap.add_argument("--url", help="envia por HTTP em vez de imprimir JSON-lines")
+    ap.add_argument("--batch", type=int, default=500)
+    args = ap.parse_args()
+
+    plates = [f"TST{i:04d}" for i in range(args.plates)]
+    gen = events(args.n, plates, args.dup, args.seed, args.ids)
+    if not args.url:
+        for ev in gen:
+            sys.stdout.write(json.dumps(ev) + "\n")
+        return
+    t0 = time.monotonic()
+    batch = []
+    for ev in gen:
+        batch.append(ev)
+        if len(batch) >= args.batch:
+            post(args.url, batch)
+            batch = []
+    if batch:
+        post(args.url, batch)
+    elapsed = time.monotonic() - t0
+    print(f"{args.n} eventos em {elapsed:.2f}s ({args.n / elapsed:.0f}/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()